@@ -4,23 +4,34 @@ Component that will perform object detection and identification via CodeProject.
 For more details about this platform, please refer to the documentation at
 https://home-assistant.io/components/image_processing.codeproject_ai_object
 """
-from collections import namedtuple, Counter
+from collections import Counter
+from dataclasses import dataclass, field
+import asyncio
 import datetime
 import io
 import logging
 import os
 import re
+import shutil
+import struct
 from datetime import timedelta
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, Optional
 from pathlib import Path
 
+import numpy as np
 from PIL import Image, ImageDraw, UnidentifiedImageError
 import voluptuous as vol
 
 from . import sdk as cpai
 
+try:
+    import numba
+except ImportError:  # optional, the NumPy mask is used instead
+    numba = None
+
 import homeassistant.helpers.config_validation as cv
 import homeassistant.util.dt as dt_util
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
 from homeassistant.util.pil import draw_box
 from homeassistant.components.image_processing import (
     ATTR_CONFIDENCE,
@@ -61,6 +72,12 @@ PERSON = "person"
 VEHICLE = "vehicle"
 VEHICLES = ["bicycle", "car", "motorcycle", "airplane", "bus", "train", "truck"]
 OBJECT_TYPES = [ANIMAL, OTHER, PERSON, VEHICLE]
+# label -> object type, anything missing is OTHER
+_OBJECT_TYPE = {
+    PERSON: PERSON,
+    **{animal: ANIMAL for animal in ANIMALS},
+    **{vehicle: VEHICLE for vehicle in VEHICLES},
+}
 
 
 CONF_TARGET = "target"
@@ -78,6 +95,7 @@ CONF_ROI_X_MAX = "roi_x_max"
 CONF_SCALE = "scale"
 CONF_CUSTOM_MODEL = "custom_model"
 CONF_CROP_ROI = "crop_to_roi"
+CONF_SIMILARITY_CACHE = "similarity_cache"
 
 DATETIME_FORMAT = "%Y-%m-%d_%H-%M-%S-%f"
 DEFAULT_TARGETS = [{CONF_TARGET: PERSON}]
@@ -102,6 +120,19 @@ SAVED_FILE = "saved_file"
 MIN_CONFIDENCE = 0.1
 JPG = "jpg"
 PNG = "png"
+# JPEG start of frame markers, C4 (DHT), C8 (JPG) and CC (DAC) are not frames
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+JPEG_SOS_MARKER = 0xDA
+JPEG_SOI = b"\xff\xd8"  # start of image
+# Perceptual hash of a HASH_DCT_SIZE square grayscale thumbnail, keeping the
+# HASH_SIZE square lowest frequencies, i.e. a 64 bit hash
+HASH_DCT_SIZE = 32
+HASH_SIZE = 8
+# Frames whose hashes differ by at most this many bits are considered the same
+SIMILARITY_MAX_DISTANCE = 4
+# Predictions are reused for at most this many frames in a row, so that objects
+# too small to change the hash are still detected
+SIMILARITY_MAX_REUSE = 10
 
 # rgb(red, green, blue)
 RED = (255, 0, 0)  # For objects within the ROI
@@ -139,77 +170,293 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
         vol.Optional(CONF_ALWAYS_SAVE_LATEST_FILE, default=False): cv.boolean,
         vol.Optional(CONF_SHOW_BOXES, default=True): cv.boolean,
         vol.Optional(CONF_CROP_ROI, default=False): cv.boolean,
+        vol.Optional(CONF_SIMILARITY_CACHE, default=False): cv.boolean,
     }
 )
 
-Box = namedtuple("Box", "y_min x_min y_max x_max")
-Point = namedtuple("Point", "y x")
+_FILENAME_RE = re.compile(r"(?u)[^-\w.]")
 
 
-def point_in_box(box: Box, point: Point) -> bool:
-    """Return true if point lies in box"""
-    if (box.x_min <= point.x <= box.x_max) and (box.y_min <= point.y <= box.y_max):
-        return True
-    return False
+def get_valid_filename(name: str) -> str:
+    return _FILENAME_RE.sub("", str(name).strip().replace(" ", "_"))
+
+
+def link_or_copy(src: Path, dst: Path) -> None:
+    """Make dst a hardlink of src, or a copy where links are not supported."""
+    if dst.exists() and os.path.samefile(src, dst):
+        return
+    # Link to a temporary name and swap it in, so an existing dst (possibly itself
+    # a link to an older file) is replaced rather than written through.
+    tmp = dst.with_name(dst.name + ".tmp")
+    try:
+        if tmp.exists():
+            tmp.unlink()
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+def get_jpeg_size(image: bytes) -> Optional[Tuple[int, int]]:
+    """Return (width, height) from the JPEG frame header, without decoding or
+    copying the image, which can be bytes or a memoryview. Returns None if the
+    image is not a JPEG or no frame header is found."""
+    if image[:2] != JPEG_SOI:
+        return None
+    size = len(image)
+    i = 2
+    # A frame header is 0xFF, marker, length (2), precision (1), height (2), width (2)
+    while i + 9 <= size:
+        if image[i] != 0xFF:
+            return None
+        marker = image[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+        elif marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack_from(">HH", image, i + 5)
+            return width, height
+        elif marker == JPEG_SOS_MARKER:
+            return None
+        elif 0xD0 <= marker <= 0xD9 or marker == 0x01:  # markers without a length
+            i += 2
+        else:
+            i += 2 + struct.unpack_from(">H", image, i + 2)[0]
+    return None
 
 
-def object_in_roi(roi: dict, centroid: dict) -> bool:
-    """Convenience to convert dicts to the Point and Box."""
-    target_center_point = Point(centroid["y"], centroid["x"])
-    roi_box = Box(roi["y_min"], roi["x_min"], roi["y_max"], roi["x_max"])
-    return point_in_box(roi_box, target_center_point)
+_DCT_MATRIX = np.cos(
+    np.pi
+    * np.outer(np.arange(HASH_DCT_SIZE), 2 * np.arange(HASH_DCT_SIZE) + 1)
+    / (2 * HASH_DCT_SIZE)
+)
 
 
-def get_valid_filename(name: str) -> str:
-    return re.sub(r"(?u)[^-\w.]", "", str(name).strip().replace(" ", "_"))
+def get_image_hash(image: bytes) -> int:
+    """Return the perceptual hash of an image as an int, near identical images
+    have hashes differing by only a few bits."""
+    with Image.open(io.BytesIO(image)) as img:
+        # Let the JPEG decoder downscale while decoding, only a thumbnail is needed
+        img.draft("L", (HASH_DCT_SIZE, HASH_DCT_SIZE))
+        thumbnail = img.convert("L").resize(
+            (HASH_DCT_SIZE, HASH_DCT_SIZE), Image.BILINEAR
+        )
+    pixels = np.asarray(thumbnail, dtype=np.float64)
+    dct = (_DCT_MATRIX @ pixels @ _DCT_MATRIX.T)[:HASH_SIZE, :HASH_SIZE]
+    bits = dct > np.median(dct)
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
 
 
 def get_object_type(object_name: str) -> str:
-    if object_name == PERSON:
-        return PERSON
-    elif object_name in ANIMALS:
-        return ANIMAL
-    elif object_name in VEHICLES:
-        return VEHICLE
+    return _OBJECT_TYPE.get(object_name, OTHER)
+
+
+def round_array(values: np.ndarray, decimal_places: int) -> np.ndarray:
+    """Round an array exactly like round() does for each element."""
+    rounded = np.round(values, decimal_places)
+    # np.round scales before rounding, so it can disagree with round() on halves
+    scaled = values * 10**decimal_places
+    for i in np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6):
+        rounded.flat[i] = round(float(values.flat[i]), decimal_places)
+    return rounded
+
+
+def _targets_found_kernel(
+    centroid_x: np.ndarray,
+    centroid_y: np.ndarray,
+    confidence: np.ndarray,
+    thresholds: np.ndarray,
+    check_roi: bool,
+    roi_y_min: float,
+    roi_x_min: float,
+    roi_y_max: float,
+    roi_x_max: float,
+) -> np.ndarray:
+    """Return the indices of the objects above their threshold and, if check_roi,
+    with their centroid inside the ROI."""
+    found = np.empty(confidence.shape[0], dtype=np.int64)
+    count = 0
+    for i in range(confidence.shape[0]):
+        if not confidence[i] > thresholds[i]:
+            continue
+        if check_roi and not (
+            roi_x_min <= centroid_x[i] <= roi_x_max
+            and roi_y_min <= centroid_y[i] <= roi_y_max
+        ):
+            continue
+        found[count] = i
+        count += 1
+    return found[:count]
+
+
+if numba is not None:
+    targets_found_jit = numba.njit(cache=True)(_targets_found_kernel)
+else:
+    targets_found_jit = None
+
+
+# Columns of ObjectColumns.values, the box columns first and those derived from them last
+OBJECT_COLUMNS = (
+    "height",
+    "width",
+    "y_min",
+    "x_min",
+    "y_max",
+    "x_max",
+    "confidence",
+    "box_area",
+    "centroid_x",
+    "centroid_y",
+)
+# Below this many objects, rounding each value with round() is faster than NumPy
+VECTORIZE_MIN_OBJECTS = 12
+
+
+def _column(index: int) -> property:
+    return property(lambda self: self.values[:, index])
+
+
+@dataclass
+class ObjectColumns:
+    """Formatted predictions as parallel columns, one entry per object."""
+
+    values: np.ndarray = field(
+        default_factory=lambda: np.empty((0, len(OBJECT_COLUMNS)))
+    )
+    name: List[str] = field(default_factory=list)
+    object_type: List[str] = field(default_factory=list)
+
+    height = _column(0)
+    width = _column(1)
+    y_min = _column(2)
+    x_min = _column(3)
+    y_max = _column(4)
+    x_max = _column(5)
+    confidence = _column(6)
+    box_area = _column(7)
+    centroid_x = _column(8)
+    centroid_y = _column(9)
+
+    def to_dicts(self, indices: np.ndarray = None) -> List[Dict]:
+        """Return the objects, or only those at indices, as dicts."""
+        if indices is None:
+            indices = np.arange(len(self.name))
+        # tolist() hands back plain Python floats, so the dicts stay JSON friendly
+        rows = self.values[indices].tolist()
+
+        objects = []
+        for i, (
+            box_height,
+            box_width,
+            box_y_min,
+            box_x_min,
+            box_y_max,
+            box_x_max,
+            object_confidence,
+            area,
+            center_x,
+            center_y,
+        ) in zip(indices.tolist(), rows):
+            objects.append(
+                {
+                    "bounding_box": {
+                        "height": box_height,
+                        "width": box_width,
+                        "y_min": box_y_min,
+                        "x_min": box_x_min,
+                        "y_max": box_y_max,
+                        "x_max": box_x_max,
+                    },
+                    "box_area": area,
+                    "centroid": {"x": center_x, "y": center_y},
+                    "name": self.name[i],
+                    "object_type": self.object_type[i],
+                    "confidence": object_confidence,
+                }
+            )
+        return objects
+
+
+def get_object_values(
+    predictions: list, img_width: int, img_height: int, decimal_places: int
+) -> np.ndarray:
+    """Return the OBJECT_COLUMNS of the predictions, rounded with round() one
+    value at a time."""
+    rows = []
+    for pred in predictions:
+        height = round((pred["y_max"] - pred["y_min"]) / img_height, decimal_places)
+        width = round((pred["x_max"] - pred["x_min"]) / img_width, decimal_places)
+        y_min = round(pred["y_min"] / img_height, decimal_places)
+        x_min = round(pred["x_min"] / img_width, decimal_places)
+        rows.append(
+            (
+                height,
+                width,
+                y_min,
+                x_min,
+                round(pred["y_max"] / img_height, decimal_places),
+                round(pred["x_max"] / img_width, decimal_places),
+                round(pred["confidence"] * 100, decimal_places),
+                round(height * width, decimal_places),
+                round(x_min + (width / 2), decimal_places),
+                round(y_min + (height / 2), decimal_places),
+            )
+        )
+    return np.array(rows, dtype=np.float64).reshape(-1, len(OBJECT_COLUMNS))
+
+
+def round_object_values(
+    predictions: list, img_width: int, img_height: int, decimal_places: int
+) -> np.ndarray:
+    """get_object_values with NumPy, rounding the box columns and then the columns
+    derived from them as two arrays."""
+    coords = np.array(
+        [
+            (pred["x_min"], pred["y_min"], pred["x_max"], pred["y_max"], pred["confidence"])
+            for pred in predictions
+        ],
+        dtype=np.float64,
+    ).reshape(-1, 5)
+    x_min, y_min, x_max, y_max, confidence = coords.T
+    values = np.empty((coords.shape[0], len(OBJECT_COLUMNS)))
+    values[:, 0] = (y_max - y_min) / img_height
+    values[:, 1] = (x_max - x_min) / img_width
+    values[:, 2] = y_min / img_height
+    values[:, 3] = x_min / img_width
+    values[:, 4] = y_max / img_height
+    values[:, 5] = x_max / img_width
+    values[:, 6] = confidence * 100
+    values[:, :7] = round_array(values[:, :7], decimal_places)
+
+    height, width, y_min, x_min = values[:, 0], values[:, 1], values[:, 2], values[:, 3]
+    values[:, 7] = height * width
+    values[:, 8] = x_min + (width / 2)
+    values[:, 9] = y_min + (height / 2)
+    values[:, 7:] = round_array(values[:, 7:], decimal_places)
+    return values
+
+
+def get_object_columns(
+    predictions: list, img_width: int, img_height: int
+) -> ObjectColumns:
+    """Return the formatted predictions as parallel columns."""
+    decimal_places = 3
+    if len(predictions) < VECTORIZE_MIN_OBJECTS:
+        values = get_object_values(predictions, img_width, img_height, decimal_places)
     else:
-        return OTHER
+        values = round_object_values(
+            predictions, img_width, img_height, decimal_places
+        )
+    names = [pred["label"] for pred in predictions]
+    return ObjectColumns(
+        values=values,
+        name=names,
+        object_type=[get_object_type(name) for name in names],
+    )
 
 
 def get_objects(predictions: list, img_width: int, img_height: int) -> List[Dict]:
     """Return objects with formatting and extra info."""
-    objects = []
-    decimal_places = 3
-    for pred in predictions:
-        box_width = pred["x_max"] - pred["x_min"]
-        box_height = pred["y_max"] - pred["y_min"]
-        box = {
-            "height": round(box_height / img_height, decimal_places),
-            "width": round(box_width / img_width, decimal_places),
-            "y_min": round(pred["y_min"] / img_height, decimal_places),
-            "x_min": round(pred["x_min"] / img_width, decimal_places),
-            "y_max": round(pred["y_max"] / img_height, decimal_places),
-            "x_max": round(pred["x_max"] / img_width, decimal_places),
-        }
-        box_area = round(box["height"] * box["width"], decimal_places)
-        centroid = {
-            "x": round(box["x_min"] + (box["width"] / 2), decimal_places),
-            "y": round(box["y_min"] + (box["height"] / 2), decimal_places),
-        }
-        name = pred["label"]
-        object_type = get_object_type(name)
-        confidence = round(pred["confidence"] * 100, decimal_places)
-
-        objects.append(
-            {
-                "bounding_box": box,
-                "box_area": box_area,
-                "centroid": centroid,
-                "name": name,
-                "object_type": object_type,
-                "confidence": confidence,
-            }
-        )
-    return objects
+    return get_object_columns(predictions, img_width, img_height).to_dicts()
 
 
 def setup_platform(hass, config, add_devices, discovery_info=None):
@@ -238,6 +485,7 @@ def setup_platform(hass, config, add_devices, discovery_info=None):
             save_timestamped_file=config.get(CONF_SAVE_TIMESTAMPTED_FILE),
             always_save_latest_file=config.get(CONF_ALWAYS_SAVE_LATEST_FILE),
             crop_roi=config[CONF_CROP_ROI],
+            similarity_cache=config[CONF_SIMILARITY_CACHE],
             camera_entity=camera.get(CONF_ENTITY_ID),
             name=camera.get(CONF_NAME),
         )
@@ -267,6 +515,7 @@ class ObjectClassifyEntity(ImageProcessingEntity):
         save_timestamped_file,
         always_save_latest_file,
         crop_roi,
+        similarity_cache,
         camera_entity,
         name=None,
     ):
@@ -286,18 +535,24 @@ class ObjectClassifyEntity(ImageProcessingEntity):
         for target in self._targets:
             if CONF_CONFIDENCE not in target.keys():
                 target.update({CONF_CONFIDENCE: self._confidence})
-        self._targets_names = [
+        self._target_confidences = {
+            target[CONF_TARGET]: target[CONF_CONFIDENCE] for target in targets
+        }  # target name or type -> confidence
+        self._targets_names = frozenset(
             target[CONF_TARGET] for target in targets
-        ]  # can be a name or a type
+        )  # can be a name or a type
+        # The default and most common configuration, which has its own filter
+        self._single_person_target = self._targets_names == {PERSON}
         self._camera = camera_entity
         if name:
             self._name = name
         else:
             camera_name = split_entity_id(camera_entity)[1]
             self._name = "codeproject_ai_object_{}".format(camera_name)
+        self._safe_name = get_valid_filename(self._name).lower()
 
         self._state = None
-        self._objects = []  # The parsed raw data
+        self._objects = ObjectColumns()  # The parsed raw data
         self._targets_found = []
         self._last_detection = None
 
@@ -307,6 +562,12 @@ class ObjectClassifyEntity(ImageProcessingEntity):
             "y_max": roi_y_max,
             "x_max": roi_x_max,
         }
+        self._roi_y_min = roi_y_min
+        self._roi_x_min = roi_x_min
+        self._roi_y_max = roi_y_max
+        self._roi_x_max = roi_x_max
+        # A ROI covering the whole frame filters nothing
+        self._roi_active = tuple(self._roi_dict.values()) != DEFAULT_ROI
         self._crop_roi = crop_roi
         self._scale = scale
         self._show_boxes = show_boxes
@@ -317,12 +578,93 @@ class ObjectClassifyEntity(ImageProcessingEntity):
         self._always_save_latest_file = always_save_latest_file
         self._save_timestamped_file = save_timestamped_file
         self._always_save_latest_file = always_save_latest_file
-        self._image = None
+        self._similarity_cache = similarity_cache
+        self._last_image_hash = None  # hash of the last frame sent for detection
+        self._last_predictions = None
+        self._last_predictions_reuse = 0  # frames that reused them since sent
 
     def process_image(self, image):
         """Process an image."""
-        self._image = Image.open(io.BytesIO(bytearray(image)))
-        self._image_width, self._image_height = self._image.size
+        prepared = self.prepare_image(image)
+        if prepared is None:
+            return
+        image, pil_image, image_hash = prepared
+
+        predictions = self.get_cached_predictions(image_hash)
+        if predictions is None:
+            try:
+                predictions = self._cpai_object.detect(image)
+            except cpai.CodeProjectAIException as exc:
+                _LOGGER.error("CodeProject.AI Server error : %s", exc)
+                return
+            self.cache_predictions(image_hash, predictions)
+
+        self.process_predictions(image, pil_image, predictions)
+
+    async def async_process_image(self, image):
+        """Process an image, posting it to CodeProject.AI Server from the event loop
+        while the image work runs in the executor."""
+        session = async_get_clientsession(self.hass)
+        detect_task = None
+        if not (self._crop_roi or self._scale != DEAULT_SCALE or self._similarity_cache):
+            # The image is sent unchanged, so the request does not have to wait
+            # for the image to be prepared
+            detect_task = asyncio.ensure_future(
+                self._cpai_object.async_detect(session, image)
+            )
+
+        prepared = None
+        try:
+            prepared = await self.hass.async_add_executor_job(self.prepare_image, image)
+        finally:
+            # Bad data or an error while preparing, the request is not needed
+            if prepared is None and detect_task is not None:
+                detect_task.cancel()
+        if prepared is None:
+            return
+        image, pil_image, image_hash = prepared
+
+        predictions = self.get_cached_predictions(image_hash)
+        if predictions is None:
+            if detect_task is None:
+                detect_task = self._cpai_object.async_detect(session, image)
+            try:
+                predictions = await detect_task
+            except cpai.CodeProjectAIException as exc:
+                _LOGGER.error("CodeProject.AI Server error : %s", exc)
+                return
+            self.cache_predictions(image_hash, predictions)
+
+        await self.hass.async_add_executor_job(
+            self.process_predictions, image, pil_image, predictions
+        )
+
+    def prepare_image(self, image):
+        """Crop and scale the image as configured.
+
+        Returns: (image, pil_image, image_hash) with the image bytes to send, the
+        opened image if PIL was needed (else None) and the hash of the original image
+        if similarity_cache is enabled (else None), or None if the image is bad data.
+        """
+        self._state = None
+        self._objects = ObjectColumns()  # The parsed raw data
+        self._targets_found = []
+        self._summary = {}
+
+        # The image is only opened with PIL once its pixels are needed
+        pil_image = None
+        image_hash = None
+        image_size = get_jpeg_size(image)
+        if image_size is None or self._crop_roi or self._scale != DEAULT_SCALE:
+            try:
+                pil_image = Image.open(io.BytesIO(image))
+            except UnidentifiedImageError:
+                _LOGGER.warning("CodeProject.AI Server unable to process image, bad data")
+                return None
+            image_size = pil_image.size
+        self._image_width, self._image_height = image_size
+        if self._similarity_cache:
+            image_hash = get_image_hash(image)
         # scale to roi
         if self._crop_roi:
             roi = (
@@ -331,10 +673,10 @@ class ObjectClassifyEntity(ImageProcessingEntity):
                 self._image_width * (self._roi_dict["x_max"]),
                 self._image_height * (self._roi_dict["y_max"])
             )
-            self._image = self._image.crop(roi)
-            self._image_width, self._image_height = self._image.size
+            pil_image = pil_image.crop(roi)
+            self._image_width, self._image_height = pil_image.size
             with io.BytesIO() as output:
-                self._image.save(output, format="JPEG")
+                pil_image.save(output, format="JPEG")
                 image = output.getvalue()
             _LOGGER.debug(
                 (
@@ -344,10 +686,10 @@ class ObjectClassifyEntity(ImageProcessingEntity):
         # resize image if different then default
         if self._scale != DEAULT_SCALE:
             newsize = (self._image_width * self._scale, self._image_width * self._scale)
-            self._image.thumbnail(newsize, Image.LANCZOS)
-            self._image_width, self._image_height = self._image.size
+            pil_image.thumbnail(newsize, Image.LANCZOS)
+            self._image_width, self._image_height = pil_image.size
             with io.BytesIO() as output:
-                self._image.save(output, format="JPEG")
+                pil_image.save(output, format="JPEG")
                 image = output.getvalue()
             _LOGGER.debug(
                 (
@@ -355,53 +697,56 @@ class ObjectClassifyEntity(ImageProcessingEntity):
                 )
             )
 
-        self._state = None
-        self._objects = []  # The parsed raw data
-        self._targets_found = []
-        self._summary = {}
+        return image, pil_image, image_hash
+
+    def get_cached_predictions(self, image_hash):
+        """Return the last predictions if the image is similar to the last one sent
+        for detection and they were not reused SIMILARITY_MAX_REUSE times already,
+        else None."""
+        if (
+            image_hash is not None
+            and self._last_image_hash is not None
+            and self._last_predictions_reuse < SIMILARITY_MAX_REUSE
+            and (image_hash ^ self._last_image_hash).bit_count()
+            <= SIMILARITY_MAX_DISTANCE
+        ):
+            _LOGGER.debug("Image similar to the last one, reusing its predictions")
+            self._last_predictions_reuse += 1
+            return self._last_predictions
+        return None
+
+    def cache_predictions(self, image_hash, predictions):
+        """Remember the predictions of the last image sent for detection."""
+        if image_hash is not None:
+            self._last_image_hash = image_hash
+            self._last_predictions = predictions
+            self._last_predictions_reuse = 0
+
+    def process_predictions(self, image, pil_image, predictions):
+        """Find the targets in the predictions, save the image and fire the events."""
         saved_image_path = None
 
-        try:
-            predictions = self._cpai_object.detect(image)
-        except cpai.CodeProjectAIServerException as exc:
-            _LOGGER.error("CodeProject.AI Server error : %s", exc)
-            return
-
-        self._objects = get_objects(predictions, self._image_width, self._image_height)
-        self._targets_found = []
-
-        for obj in self._objects:
-            if not (
-                (obj["name"] in self._targets_names)
-                or (obj["object_type"] in self._targets_names)
-            ):
-                continue
-            ## Then check if the type has a configured confidence, if yes assign
-            ## Then if a confidence for a named object, this takes precedence over type confidence
-            confidence = None
-            for target in self._targets:
-                if obj["object_type"] == target[CONF_TARGET]:
-                    confidence = target[CONF_CONFIDENCE]
-            for target in self._targets:
-                if obj["name"] == target[CONF_TARGET]:
-                    confidence = target[CONF_CONFIDENCE]
-            if obj["confidence"] > confidence:
-                if not self._crop_roi and not object_in_roi(self._roi_dict, obj["centroid"]):
-                    continue
-                self._targets_found.append(obj)
+        self._objects = get_object_columns(
+            predictions, self._image_width, self._image_height
+        )
+        # Only the targets found are needed as dicts, for saving and the events
+        self._targets_found = self._objects.to_dicts(
+            self.get_targets_found(self._objects)
+        )
 
         self._state = len(self._targets_found)
         if self._state > 0:
             self._last_detection = dt_util.now().strftime(DATETIME_FORMAT)
 
-        targets_found = [
-            obj["name"] for obj in self._targets_found
-        ]  # Just the list of target names, e.g. [car, car, person]
-        self._summary = dict(Counter(targets_found))  # e.g. {'car':2, 'person':1}
+        self._summary = dict(
+            Counter(obj["name"] for obj in self._targets_found)
+        )  # e.g. {'car':2, 'person':1}
 
         if self._save_file_folder:
             if self._state > 0 or self._always_save_latest_file:
                 saved_image_path = self.save_image(
+                    image,
+                    pil_image,
                     self._targets_found,
                     self._save_file_folder,
                 )
@@ -414,6 +759,71 @@ class ObjectClassifyEntity(ImageProcessingEntity):
                 target_event_data[SAVED_FILE] = saved_image_path
             self.hass.bus.fire(EVENT_OBJECT_DETECTED, target_event_data)
 
+    def get_targets_found(self, columns: ObjectColumns) -> np.ndarray:
+        """Return the indices of the objects that are targets above their confidence
+        and, unless the image was cropped to it, inside the ROI."""
+        if self._single_person_target:
+            return self.get_person_targets_found(columns)
+
+        ## A confidence configured for the object name takes precedence over the one
+        ## configured for its type, objects matching neither have no threshold (nan)
+        confidences = self._target_confidences
+        thresholds = np.array(
+            [
+                confidences[name]
+                if name in self._targets_names
+                else confidences.get(object_type, np.nan)
+                for name, object_type in zip(columns.name, columns.object_type)
+            ],
+            dtype=np.float64,
+        )
+        if targets_found_jit is not None:
+            return targets_found_jit(
+                columns.centroid_x,
+                columns.centroid_y,
+                columns.confidence,
+                thresholds,
+                self._roi_active and not self._crop_roi,
+                self._roi_y_min,
+                self._roi_x_min,
+                self._roi_y_max,
+                self._roi_x_max,
+            )
+        mask = columns.confidence > thresholds
+        if self._roi_active and not self._crop_roi:
+            mask &= (
+                (columns.centroid_x >= self._roi_x_min)
+                & (columns.centroid_x <= self._roi_x_max)
+                & (columns.centroid_y >= self._roi_y_min)
+                & (columns.centroid_y <= self._roi_y_max)
+            )
+        return np.flatnonzero(mask)
+
+    def get_person_targets_found(self, columns: ObjectColumns) -> np.ndarray:
+        """get_targets_found for a single person target, with plain Python
+        comparisons, cheaper than building arrays for the few objects of a frame."""
+        threshold = self._target_confidences[PERSON]
+        check_roi = self._roi_active and not self._crop_roi
+        roi_y_min, roi_x_min = self._roi_y_min, self._roi_x_min
+        roi_y_max, roi_x_max = self._roi_y_max, self._roi_x_max
+        found = []
+        for i, (name, confidence, center_x, center_y) in enumerate(
+            zip(
+                columns.name,
+                columns.confidence.tolist(),
+                columns.centroid_x.tolist(),
+                columns.centroid_y.tolist(),
+            )
+        ):
+            if name != PERSON or not confidence > threshold:
+                continue
+            if check_roi and not (
+                roi_x_min <= center_x <= roi_x_max and roi_y_min <= center_y <= roi_y_max
+            ):
+                continue
+            found.append(i)
+        return np.array(found, dtype=np.int64)
+
     @property
     def camera_entity(self):
         """Return camera entity id from process pictures."""
@@ -453,7 +863,10 @@ class ObjectClassifyEntity(ImageProcessingEntity):
         if self._custom_model:
             attr["custom_model"] = self._custom_model
         attr["all_objects"] = [
-            {obj["name"]: obj["confidence"]} for obj in self._objects
+            {name: confidence}
+            for name, confidence in zip(
+                self._objects.name, self._objects.confidence.tolist()
+            )
         ]
         if self._save_file_folder:
             attr[CONF_SAVE_FILE_FOLDER] = str(self._save_file_folder)
@@ -462,23 +875,14 @@ class ObjectClassifyEntity(ImageProcessingEntity):
             attr[CONF_ALWAYS_SAVE_LATEST_FILE] = self._always_save_latest_file
         return attr
 
-    def save_image(self, targets, directory) -> str:
-        """Draws the actual bounding box of the detected objects.
-
-        Returns: saved_image_path, which is the path to the saved timestamped file if configured, else the default saved image.
-        """
-        try:
-            img = self._image.convert("RGB")
-        except UnidentifiedImageError:
-            _LOGGER.warning("CodeProject.AI Server unable to process image, bad data")
-            return
+    def draw_boxes(self, img, targets):
+        """Draws the ROI and the bounding box, label and centroid of the targets."""
         draw = ImageDraw.Draw(img)
 
-        roi_tuple = tuple(self._roi_dict.values())
-        if roi_tuple != DEFAULT_ROI and self._show_boxes and not self._crop_roi:
+        if self._roi_active and not self._crop_roi:
             draw_box(
                 draw,
-                roi_tuple,
+                tuple(self._roi_dict.values()),
                 img.width,
                 img.height,
                 text="ROI",
@@ -486,8 +890,6 @@ class ObjectClassifyEntity(ImageProcessingEntity):
             )
 
         for obj in targets:
-            if not self._show_boxes:
-                break
             name = obj["name"]
             confidence = obj["confidence"]
             box = obj["bounding_box"]
@@ -509,22 +911,52 @@ class ObjectClassifyEntity(ImageProcessingEntity):
                 text="X",
                 fill=RED,
             )
+        return img
+
+    def save_image(self, image, pil_image, targets, directory) -> str:
+        """Draws the actual bounding box of the detected objects and saves the image.
+        pil_image is the already opened image, or None if it was not needed yet.
+
+        When there is nothing to draw and the image is saved as a JPEG, the received
+        JPEG bytes are written as is, without decoding and encoding them again.
+
+        Returns: saved_image_path, which is the path to the saved timestamped file if configured, else the default saved image.
+        """
+        draw_roi = self._roi_active and not self._crop_roi
+        if (
+            self._save_file_format == JPG
+            and image[:2] == JPEG_SOI
+            and not (self._show_boxes and (targets or draw_roi))
+        ):
+
+            def write_image(path):
+                path.write_bytes(image)
+
+        else:
+            if pil_image is None:
+                pil_image = Image.open(io.BytesIO(image))
+            img = pil_image.convert("RGB")
+            if self._show_boxes:
+                img = self.draw_boxes(img, targets)
+            write_image = img.save
 
         # Save images, returning the path of saved image as str
         latest_save_path = (
             directory
-            / f"{get_valid_filename(self._name).lower()}_latest.{self._save_file_format}"
+            / f"{self._safe_name}_latest.{self._save_file_format}"
         )
-        img.save(latest_save_path)
-        _LOGGER.info("CodeProject.AI saved file %s", latest_save_path)
-        saved_image_path = latest_save_path
-
         if self._save_timestamped_file:
             timestamp_save_path = (
                 directory
                 / f"{self._name}_{self._last_detection}.{self._save_file_format}"
             )
-            img.save(timestamp_save_path)
+            # encode once, the latest file is a link (or copy) of the timestamped one
+            write_image(timestamp_save_path)
             _LOGGER.info("CodeProject.AI saved file %s", timestamp_save_path)
-            saved_image_path = timestamp_save_path
-        return str(saved_image_path)
+            link_or_copy(timestamp_save_path, latest_save_path)
+            _LOGGER.info("CodeProject.AI saved file %s", latest_save_path)
+            return str(timestamp_save_path)
+
+        write_image(latest_save_path)
+        _LOGGER.info("CodeProject.AI saved file %s", latest_save_path)
+        return str(latest_save_path)
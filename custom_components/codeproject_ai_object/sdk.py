@@ -1,6 +1,9 @@
 """
 CodeProject.AI SDK core.
 """
+import asyncio
+
+import aiohttp
 import requests
 from PIL import Image
 from typing import Union, List, Set, Dict
@@ -130,6 +133,41 @@ def process_image(
         raise CodeProjectAIException(f"CodeProject.AI Server error: {response.status_code}")
 
 
+async def async_process_image(
+    session: aiohttp.ClientSession,
+    url: str,
+    image_bytes: bytes,
+    min_confidence: float,
+    timeout: int,
+    data: dict = None,
+) -> Dict:
+    """Asynchronously process image_bytes and detect. Handles common status codes"""
+
+    form = aiohttp.FormData()
+    form.add_field("image", image_bytes, filename="image")
+    form.add_field("min_confidence", str(min_confidence))
+    for key, value in (data or {}).items():
+        form.add_field(key, str(value))
+
+    try:
+        async with session.post(
+            url, data=form, timeout=aiohttp.ClientTimeout(total=timeout)
+        ) as response:
+            if response.status == HTTP_OK:
+                return await response.json(content_type=None)
+            status = response.status
+    except asyncio.TimeoutError:
+        raise CodeProjectAIException(f"CodeProject.AI Server connection timeout. Current " +
+                                      f"timeout is {timeout} seconds, try increasing this")
+    except aiohttp.ClientError as exc:
+        raise CodeProjectAIException(f"CodeProject.AI Server connection error, check your IP and port: {exc}")
+
+    if status == BAD_URL:
+        raise CodeProjectAIException(f"Bad url supplied, url {url} raised error {BAD_URL}")
+    else:
+        raise CodeProjectAIException(f"CodeProject.AI Server error: {status}")
+
+
 def get_stored_faces(url, timeout) -> List:
     """Posts a request and get the stored faces as a list"""
     try:
@@ -214,6 +252,17 @@ class CodeProjectAIObject(CodeProjectAIVision):
         )
         return response["predictions"]
 
+    async def async_detect(self, session: aiohttp.ClientSession, image_bytes: bytes):
+        """Asynchronously process image_bytes and detect."""
+        response = await async_process_image(
+            session        = session,
+            url            = self._url_detect,
+            image_bytes    = image_bytes,
+            min_confidence = self.min_confidence,
+            timeout        = self.timeout,
+        )
+        return response["predictions"]
+
 """
 class CodeProjectAIScene(CodeProjectAIVision):
     # Work with scenes
@@ -1,5 +1,32 @@
 """The tests for the CodeProject.AI Server object component."""
-from .image_processing import get_objects
+import asyncio
+import io
+import os
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+import numpy as np
+from PIL import Image
+import pytest
+
+from . import image_processing
+from .image_processing import (
+    SIMILARITY_MAX_DISTANCE,
+    SIMILARITY_MAX_REUSE,
+    ObjectClassifyEntity,
+    ObjectColumns,
+    _targets_found_kernel,
+    get_object_columns,
+    get_object_values,
+    get_image_hash,
+    get_jpeg_size,
+    get_objects,
+    link_or_copy,
+    round_array,
+    round_object_values,
+)
+from .sdk import CodeProjectAIException, async_process_image
 
 TARGET = "person"
 IMG_WIDTH = 960
@@ -82,3 +109,449 @@ def test_get_objects():
     objects = get_objects(MOCK_PREDICTIONS, IMG_WIDTH, IMG_HEIGHT)
     assert len(objects) == 3
     assert objects[0] == PARSED_PREDICTIONS[0]
+
+
+def test_round_array():
+    values = [0.3845, 2.675, 1.0005, 0.1234, 133 / 960]
+    rounded = round_array(np.array(values), 3)
+    assert rounded.tolist() == [round(val, 3) for val in values]
+    rounded = round_array(np.array(values[:4]).reshape(2, 2), 3)
+    assert rounded.ravel().tolist() == [round(val, 3) for val in values[:4]]
+
+
+def test_object_values():
+    rng = np.random.default_rng(0)
+    predictions = list(MOCK_PREDICTIONS)
+    for _ in range(50):
+        x_min, y_min = rng.integers(0, IMG_WIDTH - 1), rng.integers(0, IMG_HEIGHT - 1)
+        predictions.append(
+            {
+                "confidence": float(rng.random()),
+                "label": "car",
+                "y_min": int(y_min),
+                "x_min": int(x_min),
+                "y_max": int(rng.integers(y_min + 1, IMG_HEIGHT + 1)),
+                "x_max": int(rng.integers(x_min + 1, IMG_WIDTH + 1)),
+            }
+        )
+    # the scalar and the NumPy rounding must agree, whatever the number of objects
+    for count in (0, 1, 3, len(predictions)):
+        expected = get_object_values(predictions[:count], IMG_WIDTH, IMG_HEIGHT, 3)
+        values = round_object_values(predictions[:count], IMG_WIDTH, IMG_HEIGHT, 3)
+        assert values.tolist() == expected.tolist()
+
+
+def make_entity(**config) -> ObjectClassifyEntity:
+    entity_config = dict(
+        ip_address="localhost",
+        port=32168,
+        timeout=10,
+        custom_model="",
+        targets=[{"target": TARGET}],
+        confidence=80,
+        roi_y_min=0.0,
+        roi_x_min=0.0,
+        roi_y_max=1.0,
+        roi_x_max=1.0,
+        scale=1.0,
+        show_boxes=True,
+        save_file_folder=None,
+        save_file_format="jpg",
+        save_timestamped_file=False,
+        always_save_latest_file=False,
+        crop_roi=False,
+        similarity_cache=False,
+        camera_entity="camera.local_file",
+    )
+    entity_config.update(config)
+    return ObjectClassifyEntity(**entity_config)
+
+
+def noise_image(seed: int) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (IMG_HEIGHT // 8, IMG_WIDTH // 8), dtype=np.uint8)
+    return Image.fromarray(pixels).resize((IMG_WIDTH, IMG_HEIGHT)).convert("RGB")
+
+
+def encode_image(image_format: str, image: Image.Image = None, **params) -> bytes:
+    if image is None:
+        image = Image.new("RGB", (IMG_WIDTH, IMG_HEIGHT))
+    with io.BytesIO() as output:
+        image.save(output, format=image_format, **params)
+        return output.getvalue()
+
+
+def test_get_jpeg_size():
+    assert get_jpeg_size(encode_image("JPEG")) == (IMG_WIDTH, IMG_HEIGHT)
+    assert get_jpeg_size(encode_image("JPEG", progressive=True)) == (IMG_WIDTH, IMG_HEIGHT)
+    assert get_jpeg_size(memoryview(encode_image("JPEG"))) == (IMG_WIDTH, IMG_HEIGHT)
+    assert get_jpeg_size(encode_image("PNG")) is None
+    assert get_jpeg_size(b"\xff\xd8") is None
+
+
+def test_get_image_hash():
+    image = noise_image(0)
+    image_hash = get_image_hash(encode_image("JPEG", image))
+
+    recompressed = get_image_hash(encode_image("JPEG", image, quality=50))
+    assert (recompressed ^ image_hash).bit_count() <= SIMILARITY_MAX_DISTANCE
+
+    flipped = get_image_hash(encode_image("JPEG", image.transpose(Image.FLIP_LEFT_RIGHT)))
+    assert (flipped ^ image_hash).bit_count() > SIMILARITY_MAX_DISTANCE
+
+
+def test_link_or_copy(tmp_path, monkeypatch):
+    first = tmp_path / "first.jpg"
+    second = tmp_path / "second.jpg"
+    latest = tmp_path / "latest.jpg"
+    first.write_bytes(b"first")
+    second.write_bytes(b"second")
+
+    link_or_copy(first, latest)
+    assert os.path.samefile(first, latest)
+    # Replacing latest must not write through into the file it was linked to
+    link_or_copy(second, latest)
+    assert first.read_bytes() == b"first"
+    assert os.path.samefile(second, latest)
+    # Linking to the file it already is leaves no temporary file behind
+    link_or_copy(second, latest)
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "first.jpg",
+        "latest.jpg",
+        "second.jpg",
+    ]
+
+    def no_link(src, dst):
+        raise OSError("links not supported")
+
+    monkeypatch.setattr(os, "link", no_link)
+    link_or_copy(first, latest)
+    assert latest.read_bytes() == b"first"
+    assert not os.path.samefile(first, latest)
+    assert second.read_bytes() == b"second"
+
+
+def test_similarity_cache():
+    entity = make_entity(similarity_cache=True)
+    requests = []
+
+    def detect(image_bytes):
+        requests.append(image_bytes)
+        if len(requests) == 1:
+            raise CodeProjectAIException("CodeProject.AI Server error: 500")
+        return []
+
+    entity._cpai_object.detect = detect
+    frame = encode_image("JPEG", noise_image(0))
+    other_frame = encode_image("JPEG", noise_image(1))
+
+    # A failed request caches nothing, so the same frame is sent again
+    entity.process_image(frame)
+    assert entity.state is None
+    for _ in range(3):
+        entity.process_image(frame)
+    assert len(requests) == 2
+    assert entity.state == 0
+
+    # A similar frame reuses the predictions without moving the reference hash
+    entity.process_image(encode_image("JPEG", noise_image(0), quality=50))
+    assert len(requests) == 2
+    assert entity._last_image_hash == get_image_hash(frame)
+
+    entity.process_image(other_frame)
+    assert len(requests) == 3
+    entity.process_image(frame)
+    assert len(requests) == 4
+
+    # After SIMILARITY_MAX_REUSE frames in a row the same frame is sent again
+    for _ in range(SIMILARITY_MAX_REUSE):
+        entity.process_image(frame)
+    assert len(requests) == 4
+    entity.process_image(frame)
+    assert len(requests) == 5
+    entity.process_image(frame)
+    assert len(requests) == 5
+
+
+def reference_targets_found(entity, objects):
+    """The target filter as originally written, one object at a time."""
+    roi = entity._roi_dict
+    names = [target["target"] for target in entity._targets]
+    found = []
+    for i, obj in enumerate(objects):
+        if obj["name"] not in names and obj["object_type"] not in names:
+            continue
+        confidence = None
+        for target in entity._targets:
+            if obj["object_type"] == target["target"]:
+                confidence = target["confidence"]
+        for target in entity._targets:
+            if obj["name"] == target["target"]:
+                confidence = target["confidence"]
+        if obj["confidence"] > confidence:
+            x, y = obj["centroid"]["x"], obj["centroid"]["y"]
+            if not entity._crop_roi and not (
+                roi["x_min"] <= x <= roi["x_max"] and roi["y_min"] <= y <= roi["y_max"]
+            ):
+                continue
+            found.append(i)
+    return found
+
+
+def random_predictions(count: int) -> list:
+    rng = np.random.default_rng(0)
+    labels = ["person", "car", "truck", "dog", "cup"]
+    predictions = []
+    for _ in range(count):
+        x_min = int(rng.integers(0, IMG_WIDTH - 100))
+        y_min = int(rng.integers(0, IMG_HEIGHT - 100))
+        predictions.append(
+            {
+                "confidence": float(rng.random()),
+                "label": labels[int(rng.integers(len(labels)))],
+                "x_min": x_min,
+                "y_min": y_min,
+                "x_max": x_min + int(rng.integers(1, 100)),
+                "y_max": y_min + int(rng.integers(1, 100)),
+            }
+        )
+    return predictions
+
+
+def test_targets_found(monkeypatch):
+    columns = get_object_columns(random_predictions(200), IMG_WIDTH, IMG_HEIGHT)
+    objects = columns.to_dicts()
+    # ROI edges on the centroids of two persons, to check the ROI is inclusive
+    on_x_min = next(
+        i
+        for i, obj in enumerate(objects)
+        if obj["name"] == "person"
+        and obj["confidence"] > 60
+        and 0.1 < obj["centroid"]["x"] < 0.3
+        and 0.2 < obj["centroid"]["y"] < 0.6
+    )
+    on_y_max = next(
+        i
+        for i, obj in enumerate(objects)
+        if obj["name"] == "person"
+        and obj["confidence"] > 60
+        and 0.3 < obj["centroid"]["x"] < 0.8
+        and 0.6 < obj["centroid"]["y"] < 0.8
+    )
+    roi = dict(
+        roi_x_min=objects[on_x_min]["centroid"]["x"],
+        roi_y_max=objects[on_y_max]["centroid"]["y"],
+        roi_x_max=0.8,
+        roi_y_min=0.2,
+    )
+    configs = [
+        # car's confidence overrides the one of its vehicle type
+        dict(
+            targets=[
+                {"target": "person", "confidence": 50},
+                {"target": "vehicle", "confidence": 60},
+                {"target": "car", "confidence": 40},
+            ],
+            **roi,
+        ),
+        dict(targets=[{"target": "person", "confidence": 50}], **roi),
+    ]
+    for config in configs:
+        for crop_roi in (False, True):
+            entity = make_entity(crop_roi=crop_roi, **config)
+            expected = reference_targets_found(entity, objects)
+            assert {on_x_min, on_y_max} <= set(expected)
+            if crop_roi:
+                # the ROI is not applied again to a cropped image
+                in_roi = reference_targets_found(make_entity(**config), objects)
+                assert len(expected) > len(in_roi)
+
+            # the uncompiled kernel, the NumPy mask and the single person loop
+            monkeypatch.setattr(
+                image_processing, "targets_found_jit", _targets_found_kernel
+            )
+            if entity._single_person_target:
+                assert entity.get_person_targets_found(columns).tolist() == expected
+                entity._single_person_target = False
+            assert entity.get_targets_found(columns).tolist() == expected
+            monkeypatch.setattr(image_processing, "targets_found_jit", None)
+            assert entity.get_targets_found(columns).tolist() == expected
+
+
+def test_targets_found_jit():
+    pytest.importorskip("numba")
+    assert image_processing.targets_found_jit is not None
+    targets = [
+        {"target": "person", "confidence": 50},
+        {"target": "vehicle", "confidence": 60},
+        {"target": "car", "confidence": 40},
+    ]
+    # with few objects, below VECTORIZE_MIN_OBJECTS, and with many
+    for count in (3, 200):
+        columns = get_object_columns(random_predictions(count), IMG_WIDTH, IMG_HEIGHT)
+        objects = columns.to_dicts()
+        for roi_x_max in (1.0, 0.6):
+            entity = make_entity(targets=targets, roi_y_min=0.2, roi_x_max=roi_x_max)
+            expected = reference_targets_found(entity, objects)
+            assert entity.get_targets_found(columns).tolist() == expected
+    assert len(expected) > 0
+
+    # no objects
+    assert entity.get_targets_found(ObjectColumns()).tolist() == []
+
+
+class StubHass:
+    """The parts of hass used by async_process_image."""
+
+    def __init__(self):
+        self.bus = self
+        self.events = []
+
+    async def async_add_executor_job(self, target, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, target, *args)
+
+    def fire(self, event_type, event_data):
+        self.events.append((event_type, event_data))
+
+
+def make_async_entity(monkeypatch, predictions=None, **config):
+    """An entity with a stub hass, recording the images posted by async_detect.
+    async_detect waits for the release event when predictions is None."""
+    entity = make_entity(**config)
+    entity.hass = StubHass()
+    entity.entity_id = "image_processing.codeproject_ai_object_local_file"
+    entity.posted = []
+    entity.cancelled = []
+    entity.release = asyncio.Event()
+
+    async def async_detect(session, image_bytes):
+        entity.posted.append(image_bytes)
+        if isinstance(predictions, Exception):
+            raise predictions
+        try:
+            await entity.release.wait()
+        except asyncio.CancelledError:
+            entity.cancelled.append(image_bytes)
+            raise
+        return predictions
+
+    if predictions is not None:
+        entity.release.set()
+    monkeypatch.setattr(image_processing, "async_get_clientsession", lambda hass: None)
+    entity._cpai_object.async_detect = async_detect
+    return entity
+
+
+def test_async_process_image_bad_data(monkeypatch):
+    async def run():
+        entity = make_async_entity(monkeypatch)
+        # The unchanged image is posted before it is found to be bad data
+        await entity.async_process_image(b"not an image")
+        await asyncio.sleep(0)
+        assert entity.cancelled == [b"not an image"]
+        assert entity.state is None
+
+        entity = make_async_entity(monkeypatch)
+        frame = encode_image("JPEG")
+
+        def prepare_image(image):
+            raise OSError("truncated image")
+
+        entity.prepare_image = prepare_image
+        with pytest.raises(OSError):
+            await entity.async_process_image(frame)
+        await asyncio.sleep(0)
+        assert entity.cancelled == [frame]
+
+    asyncio.run(run())
+
+
+def test_async_process_image_server_error(monkeypatch):
+    async def run():
+        entity = make_async_entity(
+            monkeypatch, CodeProjectAIException("CodeProject.AI Server error: 500")
+        )
+        await entity.async_process_image(encode_image("JPEG"))
+        assert entity.state is None
+        assert entity.hass.events == []
+
+    asyncio.run(run())
+
+
+def test_async_process_image_similarity_cache(monkeypatch):
+    async def run():
+        entity = make_async_entity(
+            monkeypatch, MOCK_PREDICTIONS, similarity_cache=True
+        )
+        frame = encode_image("JPEG", noise_image(0))
+        for _ in range(2):
+            await entity.async_process_image(frame)
+            assert entity.state == 2
+        # The second frame reuses the cached predictions
+        assert entity.posted == [frame]
+        assert len(entity.hass.events) == 4
+        assert entity.hass.events[0][1]["entity_id"] == entity.entity_id
+
+    asyncio.run(run())
+
+
+def test_async_process_image_posts_prepared_image(monkeypatch):
+    async def run():
+        frame = encode_image("JPEG", noise_image(0))
+        for config, size in (
+            ({"crop_roi": True, "roi_x_max": 0.5}, (IMG_WIDTH // 2, IMG_HEIGHT)),
+            ({"scale": 0.5}, (IMG_WIDTH // 2, IMG_HEIGHT // 2)),
+        ):
+            entity = make_async_entity(monkeypatch, [], **config)
+            await entity.async_process_image(frame)
+            assert len(entity.posted) == 1
+            assert get_jpeg_size(entity.posted[0]) == size
+            assert entity.state == 0
+
+    asyncio.run(run())
+
+
+def serve_detection(handler):
+    """Post an image with sdk.async_process_image to a local server running
+    handler, with a 0.2 second timeout."""
+
+    async def run():
+        app = web.Application()
+        app.router.add_post("/v1/vision/detection", handler)
+        async with TestServer(app) as server, aiohttp.ClientSession() as session:
+            return await async_process_image(
+                session,
+                str(server.make_url("/v1/vision/detection")),
+                b"image bytes",
+                0.45,
+                0.2,
+            )
+
+    return asyncio.run(run())
+
+
+def test_async_process_image_sdk():
+    received = {}
+
+    async def detection(request):
+        form = await request.post()
+        received["image"] = form["image"].file.read()
+        received["min_confidence"] = form["min_confidence"]
+        return web.json_response({"success": True, "predictions": MOCK_PREDICTIONS})
+
+    response = serve_detection(detection)
+    assert response["predictions"] == MOCK_PREDICTIONS
+    assert received == {"image": b"image bytes", "min_confidence": "0.45"}
+
+    async def server_error(request):
+        return web.Response(status=500)
+
+    with pytest.raises(CodeProjectAIException, match="500"):
+        serve_detection(server_error)
+
+    async def slow(request):
+        await asyncio.sleep(1)
+        return web.json_response({"success": True, "predictions": []})
+
+    with pytest.raises(CodeProjectAIException, match="timeout"):
+        serve_detection(slow)